@@ -1,21 +1,35 @@
 ### streamlit page to take user_query and proposed_answer as input and get the final answer along with the summary of changes in the final output
 
+import os
 import streamlit as st
-from faff_qa import process_answer
+from faff_qa import FORMATTING_EXAMPLES_CSV, FusedAnswerStream, build_answer_quality_graph, load_formatting_examples_from_csv, process_answer
+
+@st.cache_resource
+def get_graph(examples_mtime: float):
+    # Compiled once per version of the examples CSV and shared across reruns and sessions
+    return build_answer_quality_graph(load_formatting_examples_from_csv())
 
 def main():
+    use_graph = st.sidebar.checkbox('Debug: run the step-by-step LangGraph pipeline')
     user_query = st.text_input('Enter your query')
     proposed_answer = st.text_area('Enter the proposed answer')
     if st.button('Process Answer'):
-        result = process_answer(user_query, proposed_answer)
         ## heading
         st.header('Final Answer')
-        st.write('Final Answer:', result["final_answer"]["final_answer"])
+        if use_graph:
+            graph = get_graph(os.path.getmtime(FORMATTING_EXAMPLES_CSV))
+            result = process_answer(user_query, proposed_answer, graph=graph)["final_answer"]
+            st.write(result['final_answer'])
+        else:
+            # streamed while Claude is still writing the assessment
+            answer_stream = FusedAnswerStream(user_query, proposed_answer)
+            st.write_stream(answer_stream)
+            result = answer_stream.result
 
         ## summary of changes
         st.header('Summary of Changes')
-        st.write('Adequacy Issues:', result["final_answer"]['adequacy_assessment'])
-        st.write('Formatting Improvements:', result["final_answer"]["format_assessment"]["formatting_issues"])
+        st.write('Adequacy Issues:', result['adequacy_assessment'])
+        st.write('Formatting Improvements:', (result['format_assessment'] or {}).get('formatting_issues', []))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
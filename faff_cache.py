@@ -0,0 +1,83 @@
+import json
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+EmbedFn = Callable[[str], List[float]]
+
+def minilm_embedder() -> EmbedFn:
+    # Optional dependency, only needed when semantic matching is switched on
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    return lambda text: model.encode(text, normalize_embeddings=True).tolist()
+
+class SemanticCache:
+    # SQLite-backed cache of processed answers.
+    # The namespace names everything else a result depends on (model, pipeline, prompt version).
+    # Exact (query, answer, namespace) matches are looked up by SHA-256 key. When an embed_fn is given,
+    # misses fall back to the closest stored (query, answer) pair in the namespace with cosine similarity >= threshold.
+    def __init__(self, db_path: str = "faff_qa_cache.sqlite3", threshold: float = 0.92, embed_fn: Optional[EmbedFn] = None):
+        self.threshold = threshold
+        self.embed_fn = embed_fn
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, embedding BLOB, result TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+        # Embeddings are kept in memory so a semantic lookup is a single matrix-vector product
+        self._keys: Dict[str, List[str]] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        if embed_fn is not None:
+            for key, namespace, blob in self._conn.execute("SELECT key, namespace, embedding FROM reviews WHERE embedding IS NOT NULL"):
+                self._add_vector(key, namespace, np.frombuffer(blob, dtype=np.float32))
+
+    @staticmethod
+    def exact_key(user_query: str, proposed_answer: str, namespace: str) -> str:
+        payload = json.dumps([user_query, proposed_answer, namespace])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _embed(self, user_query: str, proposed_answer: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(user_query + "\n" + proposed_answer), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _add_vector(self, key: str, namespace: str, vector: np.ndarray) -> None:
+        self._keys.setdefault(namespace, []).append(key)
+        if namespace in self._vectors:
+            self._vectors[namespace] = np.vstack([self._vectors[namespace], vector])
+        else:
+            self._vectors[namespace] = vector.reshape(1, -1)
+
+    def get(self, user_query: str, proposed_answer: str, namespace: str) -> Optional[Dict]:
+        key = self.exact_key(user_query, proposed_answer, namespace)
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM reviews WHERE key = ?", (key,)).fetchone()
+            if row:
+                return json.loads(row[0])
+            if self.embed_fn is None or namespace not in self._vectors:
+                return None
+
+            scores = self._vectors[namespace] @ self._embed(user_query, proposed_answer)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            row = self._conn.execute("SELECT result FROM reviews WHERE key = ?", (self._keys[namespace][best],)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, user_query: str, proposed_answer: str, namespace: str, result: Dict) -> None:
+        key = self.exact_key(user_query, proposed_answer, namespace)
+        vector = self._embed(user_query, proposed_answer) if self.embed_fn is not None else None
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM reviews WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reviews (key, namespace, embedding, result) VALUES (?, ?, ?, ?)",
+                (key, namespace, vector.tobytes() if vector is not None else None, json.dumps(result)),
+            )
+            self._conn.commit()
+            if vector is not None and not exists:
+                self._add_vector(key, namespace, vector)
@@ -1,56 +1,106 @@
 import os
+import re
 import json
+import hashlib
 import csv
+import time
+import asyncio
+import httpx
 import anthropic
-from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Any, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
-from pydantic import BaseModel, Field
+from faff_cache import SemanticCache
 
-class AgentState(BaseModel):
-    user_query: str = Field(description="Original question asked by the user")
-    proposed_answer: str = Field(description="Answer proposed by the human agent")
-    grammar_fixed_answer: Optional[str] = Field(None, description="Answer with grammar fixed")
-    adequacy_assessment: Optional[Dict] = Field(None, description="Assessment of answer adequacy")
-    format_assessment: Optional[Dict] = Field(None, description="Assessment of answer formatting")
-    final_answer: Optional[str] = Field(None, description="Final processed answer")
+CLAUDE_MODEL = "claude-3-7-sonnet-20250219"
+# Minimal grammar fixes don't need the flagship model and sit on the critical path of the graph
+GRAMMAR_MODEL = "claude-3-5-haiku-latest"
+RESPONSE_CACHE_PATH = "faff_qa_cache.sqlite3"
+FORMATTING_EXAMPLES_CSV = "faff_formatting_examples.csv"
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+HTTP_TIMEOUT = 60.0
 
-def get_claude_client(api_key: Optional[str] = None):
-    api_key = "sk-ant-REDACTED"
+@dataclass(slots=True)
+class AgentState:
+    user_query: str
+    proposed_answer: str
+    grammar_fixed_answer: Optional[str] = None
+    adequacy_assessment: Optional[Dict] = None
+    format_assessment: Optional[Dict] = None
+    final_answer: Optional[str] = None
+
+@lru_cache()
+def get_response_cache() -> SemanticCache:
+    # Exact-match only: near-identical answers can still differ in prices, links or slots, so semantic
+    # matching is opt-in by constructing SemanticCache with an embed_fn (see faff_cache.minilm_embedder).
+    # Only the fused path is cached; the LangGraph path exists to debug its stages and always runs them.
+    return SemanticCache(RESPONSE_CACHE_PATH)
+
+def resolve_api_key(api_key: Optional[str] = None) -> str:
+    api_key = api_key or os.environ.get("ANTHROPIC_API_KEY")
     if not api_key:
         raise ValueError("API key must be provided or set as ANTHROPIC_API_KEY environment variable")
-    return anthropic.Anthropic(api_key=api_key)
+    return api_key
 
-def load_formatting_examples_from_csv() -> List[Dict]:
-    csv_path = "faff_formatting_examples.csv"
-    examples = []
-    
+def get_claude_client(api_key: Optional[str] = None):
+    api_key = resolve_api_key(api_key)
+    return anthropic.Anthropic(api_key=api_key, http_client=anthropic.DefaultHttpxClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT))
+
+@lru_cache()
+def get_shared_claude_client():
+    # One client per process so Streamlit reruns and successive calls reuse pooled TCP/TLS connections
+    return get_claude_client()
+
+def get_async_claude_client(api_key: Optional[str] = None):
+    api_key = resolve_api_key(api_key)
+    # Not shared like the sync client: its connection pool is tied to the event loop of a single asyncio.run
+    return anthropic.AsyncAnthropic(api_key=api_key, http_client=anthropic.DefaultAsyncHttpxClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT))
+
+class FormattingExamples(NamedTuple):
+    examples: Tuple[Dict, ...]
+    # Examples rendered once into the prompt fragment used by the formatting and fused prompts
+    prompt: str
+
+def load_formatting_examples_from_csv(csv_path: str = FORMATTING_EXAMPLES_CSV) -> FormattingExamples:
+    # Keyed on mtime so edits to the CSV are picked up without reparsing it on every request
+    return _load_formatting_examples(os.path.abspath(csv_path), os.path.getmtime(csv_path))
+
+@lru_cache(maxsize=4)
+def _load_formatting_examples(csv_path: str, mtime: float) -> FormattingExamples:
     with open(csv_path, 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            change_descriptions = []
-            for i in range(1, 5):
-                key = f"Change Description {i}"
-                if key in row and row[key].strip():
-                    change_descriptions.append(row[key].strip())
-            
-            explanation = "\n".join([f"• {desc}" for desc in change_descriptions])
-            
-            example = {
-                "task": row["Task"],
-                "bad_format": row["Bad Formatting"],
-                "good_format": row["Good Formatting"],
-                "explanation": explanation,
+        reader = csv.reader(file)
+        header = next(reader)
+        # Resolve column positions once instead of building a dict per row
+        idx_task, idx_bad, idx_good = (header.index(column) for column in ("Task", "Bad Formatting", "Good Formatting"))
+        idx_descriptions = [header.index(column) for column in (f"Change Description {i}" for i in range(1, 5)) if column in header]
+        
+        examples = [
+            {
+                "task": row[idx_task],
+                "bad_format": row[idx_bad],
+                "good_format": row[idx_good],
+                "explanation": "\n".join(
+                    f"• {row[i].strip()}" for i in idx_descriptions if i < len(row) and row[i].strip()
+                ),
             }
-            examples.append(example)
+            for row in reader
+            if row  # skip blank lines
+        ]
     
-    return examples
+    return FormattingExamples(tuple(examples), render_formatting_examples(examples))
 
-# Node 1: Fix grammar with minimal changes
-def fix_grammar(state: AgentState, client=None) -> Dict:
-    if not client:
-        client = get_claude_client()
-    
-    prompt = f"""I need you to fix ONLY critical grammar issues in the following answer.
+# The fused prompt asks for the final answer first and the JSON assessment after ASSESSMENT_TAG, so the
+# answer can be streamed to the user while the assessment is still being generated
+ASSESSMENT_TAG = "<assessment>"
+ASSESSMENT_END_TAG = "</assessment>"
+
+# Static system prompts. They are kept byte-identical across requests so the cached prefix keeps hitting;
+# the formatting and fused prompts get the rendered examples filled into {examples_text}
+GRAMMAR_SYSTEM_PROMPT = """You are a conservative grammar editor. Your job is to make the absolute minimum changes necessary to fix only clear grammatical errors. Preserve the author's original words, style and voice completely.
+
+I need you to fix ONLY critical grammar issues in the answer you are given.
 Make the absolute minimum changes necessary - only fix clear grammatical errors.
 Do not:
 - Change word choice unless absolutely necessary for grammar
@@ -60,146 +110,236 @@ Do not:
 - Add or remove information
 
 The text should read almost identically to the original, just with grammar errors fixed.
-Return ONLY the corrected text with no additional explanations.
+Return ONLY the corrected text with no additional explanations."""
+
+ADEQUACY_SYSTEM_PROMPT = """You are an expert at evaluating customer service responses. Be thorough but practical in your assessment. Only suggest changes when truly necessary to address the user's query.
+
+Evaluate if the proposed answer adequately and explicitly addresses the user's query.
 
-Original answer: {state.proposed_answer}"""
+Your task:
+1. Identify if the answer fully addresses all aspects of the user's query
+2. Check if any important information is missing
+3. Note if the answer contains irrelevant information
+4. Suggest specific improvements if needed
+
+Report your evaluation with the return_adequacy tool."""
+
+FORMATTING_SYSTEM_PROMPT = """You are an expert at formatting customer service responses for maximum readability and clarity. Apply the patterns from good examples while preserving the meaning and content of the answer. Only suggest changes when truly necessary. Do not add additional information and keep the answer clear and concise.
+
+Improve the formatting of the customer service answer you are given to make it more readable and user-friendly.
+Keep the content largely the same, but apply formatting best practices based on these examples:
+
+{examples_text}
+
+Report your assessment with the return_format_assessment tool."""
+
+FUSED_SYSTEM_PROMPT = """You are an expert reviewer of customer service responses. You are a conservative grammar editor, a practical judge of whether an answer addresses the query, and an expert at formatting responses for maximum readability. Preserve the author's original words, style and voice wherever possible.
+
+Review the proposed answer to the user's query in four steps.
+
+Step 1 - Grammar: fix ONLY critical grammar issues with the absolute minimum changes necessary.
+Do not:
+- Change word choice unless absolutely necessary for grammar
+- Alter sentence structure
+- Modify punctuation unless it's grammatically incorrect
+- Change the style, tone, formality level, or voice
+- Add or remove information
+
+Step 2 - Adequacy: working from the grammar-fixed answer,
+1. Identify if the answer fully addresses all aspects of the user's query
+2. Check if any important information is missing
+3. Note if the answer contains irrelevant information
+4. Suggest specific improvements only when truly necessary to address the user's query
+
+Step 3 - Formatting: improve the formatting to make the answer more readable and user-friendly.
+Keep the content largely the same, but apply formatting best practices based on these examples:
+
+{examples_text}
+
+Step 4 - Final answer: produce the final answer with the necessary adequacy improvements and the formatting applied.
+Do not add additional information and keep the answer clear and concise.
+
+Respond with the final answer text first, exactly as it should be sent to the user, with no preamble.
+Then write JSON between {assessment_tag} and {assessment_end_tag} tags with these fields:
+- "grammar_fixed": the answer with only grammar errors fixed
+- "adequacy_assessment": object with "adequately_addressed" (boolean), "missing_aspects" (list of strings, empty if none) and "suggestions" (list of specific improvements, empty if none)
+- "format_assessment": object with "formatting_issues" (list of formatting issues identified) and "improvements_made" (list of improvements you made)"""
+
+# Structured outputs for the adequacy and formatting nodes, forced via tool_choice
+ADEQUACY_TOOL = {
+    "name": "return_adequacy",
+    "description": "Report whether the proposed answer adequately addresses the user's query.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "adequately_addressed": {"type": "boolean"},
+            "missing_aspects": {"type": "array", "items": {"type": "string"}, "description": "Missing aspects of the query (empty if none)"},
+            "suggestions": {"type": "array", "items": {"type": "string"}, "description": "Specific improvements (empty if none)"},
+            "improved_answer": {"type": "string", "description": "The answer with your suggested improvements incorporated (if any, otherwise the original)"},
+        },
+        "required": ["adequately_addressed", "missing_aspects", "suggestions", "improved_answer"],
+    },
+}
+
+FORMATTING_TOOL = {
+    "name": "return_format_assessment",
+    "description": "Report the formatting issues found and the answer with better formatting.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "formatting_issues": {"type": "array", "items": {"type": "string"}, "description": "Formatting issues identified"},
+            "improvements_made": {"type": "array", "items": {"type": "string"}, "description": "Improvements you made"},
+            "improved_answer": {"type": "string", "description": "The answer with better formatting"},
+        },
+        "required": ["formatting_issues", "improvements_made", "improved_answer"],
+    },
+}
+
+def render_formatting_examples(formatting_examples: Sequence[Dict]) -> str:
+    return "".join(
+        f"\nExample {i+1}:\n"
+        f"User Query: {example['task']}\n"
+        f"Bad format: {example['bad_format']}\n"
+        f"Good format: {example['good_format']}\n"
+        f"Changes made: {example['explanation']}\n"
+        for i, example in enumerate(formatting_examples)
+    )
+
+def cached_system_prompt(system_text: str) -> List[Dict]:
+    # Static system text is marked for prompt caching so repeat requests skip prefill of the shared prefix.
+    # Prompts shorter than the model's minimum cacheable length are simply processed uncached.
+    return [{"type": "text", "text": system_text, "cache_control": {"type": "ephemeral"}}]
+
+@lru_cache(maxsize=8)
+def examples_system_prompt(system_template: str, examples_text: str) -> List[Dict]:
+    # Built once per examples version; the returned blocks are shared between requests and must not be mutated
+    return cached_system_prompt(system_template.format(examples_text=examples_text, assessment_tag=ASSESSMENT_TAG, assessment_end_tag=ASSESSMENT_END_TAG))
+
+_GRAMMAR_SYSTEM = cached_system_prompt(GRAMMAR_SYSTEM_PROMPT)
+_ADEQUACY_SYSTEM = cached_system_prompt(ADEQUACY_SYSTEM_PROMPT)
+
+# Node 1: Fix grammar with minimal changes
+async def fix_grammar(state: AgentState, client=None) -> Dict:
+    if not client:
+        client = get_async_claude_client()
     
-    message = client.messages.create(
-        model="claude-3-7-sonnet-20250219",
-        max_tokens=1024,
+    prompt = f"Original answer: {state.proposed_answer}"
+    
+    # The corrected text is about as long as the original (~4 characters per token for Latin text), so budget
+    # roughly twice that plus headroom, capped at the previous 1024. Scripts like Devanagari can run close to
+    # a token per character, so a reply cut off at max_tokens is discarded below rather than passed on.
+    message = await client.messages.create(
+        model=GRAMMAR_MODEL,
+        max_tokens=min(1024, len(state.proposed_answer) // 2 + 128),
         temperature=0.0,
-        system="You are a conservative grammar editor. Your job is to make the absolute minimum changes necessary to fix only clear grammatical errors. Preserve the author's original words, style and voice completely.",
+        system=_GRAMMAR_SYSTEM,
         messages=[{"role": "user", "content": prompt}]
     )
     
+    if message.stop_reason == "max_tokens":
+        # A truncated fix would silently drop content for the adequacy and formatting stages
+        return {"grammar_fixed_answer": state.proposed_answer}
+    
     grammar_fixed_answer = message.content[0].text
     return {"grammar_fixed_answer": grammar_fixed_answer}
 
-def check_adequacy(state: AgentState, client=None) -> Dict:
+# Nodes 2 and 3 both start from the grammar-fixed answer and run in parallel
+async def check_adequacy(state: AgentState, client=None) -> Dict:
     if not client:
-        client = get_claude_client()
+        client = get_async_claude_client()
     
     grammar_fixed = state.grammar_fixed_answer or state.proposed_answer
     
-    prompt = f"""Evaluate if the proposed answer adequately and explicitly addresses the user's query.
-
-User Query: {state.user_query}
-
-Proposed Answer: {grammar_fixed}
+    prompt = f"""User Query: {state.user_query}
 
-Your task:
-1. Identify if the answer fully addresses all aspects of the user's query
-2. Check if any important information is missing
-3. Note if the answer contains irrelevant information
-4. Suggest specific improvements if needed
-
-Return your evaluation as JSON with these fields:
-- "adequately_addressed": boolean
-- "missing_aspects": list of strings (empty if none)
-- "suggestions": list of specific improvements (empty if none)
-- "improved_answer": the answer with your suggested improvements incorporated (if any, otherwise return the original)
-"""
+Proposed Answer: {grammar_fixed}"""
     
-    message = client.messages.create(
-        model="claude-3-7-sonnet-20250219",
+    message = await client.messages.create(
+        model=CLAUDE_MODEL,
         max_tokens=2048,
         temperature=0.0,
-        system="You are an expert at evaluating customer service responses. Be thorough but practical in your assessment. Only suggest changes when truly necessary to address the user's query.",
+        system=_ADEQUACY_SYSTEM,
+        tools=[ADEQUACY_TOOL],
+        tool_choice={"type": "tool", "name": ADEQUACY_TOOL["name"]},
         messages=[{"role": "user", "content": prompt}]
     )
     
-    # Extract JSON from response
-    response_text = message.content[0].text
-    try:
-        # Handle if Claude wraps the JSON in code blocks
-        if "```json" in response_text:
-            json_content = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            json_content = response_text.split("```")[1].split("```")[0].strip()
-        else:
-            json_content = response_text.strip()
-            
-        adequacy_assessment = json.loads(json_content)
-    except json.JSONDecodeError:
-        # Fallback if parsing fails
-        adequacy_assessment = {
-            "adequately_addressed": False,
-            "missing_aspects": ["Unable to parse assessment"],
-            "suggestions": ["Error processing assessment"],
-            "improved_answer": state.grammar_fixed_answer or state.proposed_answer
-        }
-    
-    return {"adequacy_assessment": adequacy_assessment}
+    # The forced tool call carries the assessment as an already-parsed dict
+    return {"adequacy_assessment": message.content[0].input}
 
-def improve_formatting(state: AgentState, formatting_examples: List[Dict], client=None) -> Dict:
+async def improve_formatting(state: AgentState, formatting_examples: FormattingExamples, client=None, answer: Optional[str] = None) -> Dict:
     if not client:
-        client = get_claude_client()
+        client = get_async_claude_client()
     
-    current_answer = state.adequacy_assessment.get("improved_answer", "") if state.adequacy_assessment else ""
-    if not current_answer:
-        current_answer = state.grammar_fixed_answer or state.proposed_answer
+    current_answer = answer or state.grammar_fixed_answer or state.proposed_answer
  
-    examples_to_use = formatting_examples
-    
-    examples_text = ""
-    for i, example in enumerate(examples_to_use):
-        examples_text += f"\nExample {i+1}:\n"
-        examples_text += f"User Query: {example['task']}\n"
-        examples_text += f"Bad format: {example['bad_format']}\n"
-        examples_text += f"Good format: {example['good_format']}\n"
-        examples_text += f"Changes made: {example['explanation']}\n"
-        
-    prompt = f"""Improve the formatting of this customer service answer to make it more readable and user-friendly.
-Keep the content largely the same, but apply formatting best practices based on these examples:
-
-{examples_text}
-
-Current Task: {state.user_query}
+    prompt = f"""Current Task: {state.user_query}
 Current Answer:
-{current_answer}
-
-Return your assessment as JSON with these fields:
-- "formatting_issues": list of formatting issues identified
-- "improvements_made": list of improvements you made
-- "improved_answer": the answer with better formatting
-"""
+{current_answer}"""
     
-    message = client.messages.create(
-        model="claude-3-7-sonnet-20250219",
+    message = await client.messages.create(
+        model=CLAUDE_MODEL,
         max_tokens=2048,
         temperature=0.0,
-        system="You are an expert at formatting customer service responses for maximum readability and clarity. Apply the patterns from good examples while preserving the meaning and content of the answer. Only suggest changes when truly necessary. Do not add additional information and keep the answer clear and concise.",
+        system=examples_system_prompt(FORMATTING_SYSTEM_PROMPT, formatting_examples.prompt),
+        tools=[FORMATTING_TOOL],
+        tool_choice={"type": "tool", "name": FORMATTING_TOOL["name"]},
         messages=[{"role": "user", "content": prompt}]
     )
     
-    # Extract JSON from response
-    response_text = message.content[0].text
-    try:
-        # Handle if Claude wraps the JSON in code blocks
-        if "```json" in response_text:
-            json_content = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            json_content = response_text.split("```")[1].split("```")[0].strip()
-        else:
-            json_content = response_text.strip()
-            
-        format_assessment = json.loads(json_content)
-    except json.JSONDecodeError:
-        # Fallback if parsing fails
-        format_assessment = {
-            "formatting_issues": ["Unable to parse assessment"],
-            "improvements_made": ["Error processing formatting"],
-            "improved_answer": current_answer
-        }
-    
-    return {"format_assessment": format_assessment}
+    return {"format_assessment": message.content[0].input}
+
+# Bullet characters anywhere, a leading dash/asterisk/number list marker (including the word-joiner padding
+# seen in pasted lists), inline numbered items such as "1. ... 2. ...", and raw links
+_BULLET_RE = re.compile(r"[•·▪●]")
+_LEADING_MARKER_RE = re.compile(r"^(?:[\-*]|\d+[.)])[ \t\u2060]")
+_INLINE_NUMBERED_RE = re.compile(r"(?:^|\s)\d+[.)]\s")
+_URL_RE = re.compile(r"https?://|www\.")
+
+def _formatting_likely_bad(answer: str) -> bool:
+    # Deliberately conservative: only a short single paragraph of plain prose is treated as already
+    # well formatted. Every example in the formatting CSV still goes through improve_formatting.
+    answer = answer.strip()
+    if len(answer) > 400 or "\n" in answer:
+        return True
+    return (
+        bool(_BULLET_RE.search(answer))
+        or bool(_LEADING_MARKER_RE.match(answer))
+        or len(_INLINE_NUMBERED_RE.findall(answer)) >= 2
+        or bool(_URL_RE.search(answer))
+    )
+
+def route_after_grammar(state: AgentState) -> List[str]:
+    # improve_formatting costs a Claude call, so skip it when the answer doesn't look like it needs one
+    if _formatting_likely_bad(state.grammar_fixed_answer or state.proposed_answer):
+        return ["check_adequacy", "improve_formatting"]
+    return ["check_adequacy"]
+
+def _adequacy_rewrite(state: AgentState) -> str:
+    # The adequacy check's rewrite, only when it found that the answer did not address the query
+    if state.adequacy_assessment and not state.adequacy_assessment.get("adequately_addressed", True):
+        return state.adequacy_assessment.get("improved_answer", "")
+    return ""
+
+def join_branches(state: AgentState) -> Dict:
+    # Runs once both parallel branches have finished, so the route below sees both results
+    return {}
+
+def route_after_join(state: AgentState) -> str:
+    return "format_adequacy_answer" if _adequacy_rewrite(state) else "create_final"
+
+# Node 3b: Format the adequacy rewrite, which the parallel formatting branch never saw
+async def format_adequacy_answer(state: AgentState, formatting_examples: FormattingExamples, client=None) -> Dict:
+    adequacy_answer = _adequacy_rewrite(state)
+    if not _formatting_likely_bad(adequacy_answer):
+        # Drop the assessment of the grammar-fixed text so the summary only reports formatting that was applied
+        return {"format_assessment": None}
+    return await improve_formatting(state, formatting_examples, client, answer=adequacy_answer)
 
 # Node 4: Create final answer with summary of changes
-def create_final_answer(state: AgentState, client=None) -> Dict:
-    if not client:
-        client = get_claude_client()
-    
-    # Get the formatted answer
+def create_final_answer(state: AgentState) -> Dict:
+    # Get the formatted answer; when the answer did not address the query, format_assessment describes
+    # the formatted adequacy rewrite (or was dropped if that needed no formatting)
     formatted_answer = state.format_assessment.get("improved_answer", "") if state.format_assessment else ""
     if not formatted_answer:
         # Fallback chain
@@ -228,23 +368,39 @@ def create_final_answer(state: AgentState, client=None) -> Dict:
     return {"final_answer": final_answer, "changes_summary": changes_summary}
 
 # Build the LangGraph workflow
-def build_answer_quality_graph(formatting_examples: List[Dict]) -> StateGraph:
-    # Create Claude client to reuse
-    client = get_claude_client()
+def build_answer_quality_graph(formatting_examples: FormattingExamples) -> StateGraph:
+    # The async Claude client is bound to the event loop of a single run, so it is passed in
+    # through config["configurable"]["client"] instead of being captured here
+    async def grammar_node(state: AgentState, config: RunnableConfig) -> Dict:
+        return await fix_grammar(state, config["configurable"]["client"])
+    
+    async def adequacy_node(state: AgentState, config: RunnableConfig) -> Dict:
+        return await check_adequacy(state, config["configurable"]["client"])
+    
+    async def formatting_node(state: AgentState, config: RunnableConfig) -> Dict:
+        return await improve_formatting(state, formatting_examples, config["configurable"]["client"])
+    
+    async def adequacy_formatting_node(state: AgentState, config: RunnableConfig) -> Dict:
+        return await format_adequacy_answer(state, formatting_examples, config["configurable"]["client"])
     
     # Create the graph with our state
     workflow = StateGraph(AgentState)
     
     # Add nodes
-    workflow.add_node("fix_grammar", lambda state: fix_grammar(state, client))
-    workflow.add_node("check_adequacy", lambda state: check_adequacy(state, client))
-    workflow.add_node("improve_formatting", lambda state: improve_formatting(state, formatting_examples, client))
-    workflow.add_node("create_final", lambda state: create_final_answer(state, client))
-    
-    # Connect the nodes in sequence
-    workflow.add_edge("fix_grammar", "check_adequacy")
-    workflow.add_edge("check_adequacy", "improve_formatting")
-    workflow.add_edge("improve_formatting", "create_final")
+    workflow.add_node("fix_grammar", grammar_node)
+    workflow.add_node("check_adequacy", adequacy_node)
+    workflow.add_node("improve_formatting", formatting_node)
+    workflow.add_node("join_branches", join_branches)
+    workflow.add_node("format_adequacy_answer", adequacy_formatting_node)
+    workflow.add_node("create_final", create_final_answer)
+    
+    # Fan out after grammar fixing (formatting only when needed) and join the branches. An adequacy
+    # rewrite is new text, so it gets its own formatting step before the final answer.
+    workflow.add_conditional_edges("fix_grammar", route_after_grammar, ["check_adequacy", "improve_formatting"])
+    workflow.add_edge("check_adequacy", "join_branches")
+    workflow.add_edge("improve_formatting", "join_branches")
+    workflow.add_conditional_edges("join_branches", route_after_join, ["format_adequacy_answer", "create_final"])
+    workflow.add_edge("format_adequacy_answer", "create_final")
     workflow.add_edge("create_final", END)
     
     # Set the entry point
@@ -253,22 +409,234 @@ def build_answer_quality_graph(formatting_examples: List[Dict]) -> StateGraph:
     # Compile the graph
     return workflow.compile()
 
-# Main function to process an answer
-def process_answer(user_query: str, proposed_answer: str) -> Dict:
-    # Load examples from CSV if not provided directly
-    formatting_examples = load_formatting_examples_from_csv()
+# Handle if Claude wraps the JSON in code blocks
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+def _extract_json(text: str) -> Dict:
+    # Unfenced JSON is parsed as-is first, so strings that themselves contain ``` aren't cut at the backticks
+    try:
+        return json.loads(text.strip())
+    except json.JSONDecodeError:
+        match = _FENCE_RE.search(text)
+        if not match:
+            raise
+        return json.loads(match.group(1))
+
+# Single-call path: grammar, adequacy, formatting and final answer in one request
+def build_fused_request(user_query: str, proposed_answer: str, formatting_examples: FormattingExamples) -> Dict:
+    prompt = f"""User Query: {user_query}
+
+Proposed Answer:
+{proposed_answer}"""
     
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": 4096,
+        "temperature": 0.0,
+        "system": examples_system_prompt(FUSED_SYSTEM_PROMPT, formatting_examples.prompt),
+        "messages": [{"role": "user", "content": prompt}],
+    }
+
+@lru_cache(maxsize=8)
+def fused_cache_namespace(examples_text: str) -> str:
+    # Cached reviews are tied to the model and the exact system prompt, so editing the prompt or the
+    # examples CSV starts a fresh namespace instead of serving reviews from the old examples
+    system_text = examples_system_prompt(FUSED_SYSTEM_PROMPT, examples_text)[0]["text"]
+    return f"fused:{CLAUDE_MODEL}:{hashlib.sha256(system_text.encode('utf-8')).hexdigest()[:16]}"
+
+def parse_fused_response(user_query: str, proposed_answer: str, response_text: str) -> Tuple[Dict, bool]:
+    # Returns the review and whether the assessment parsed; fallbacks must not end up in the response cache
+    final_answer, _, response_text = response_text.partition(ASSESSMENT_TAG)
+    # Only the text between the tags is JSON; a missing closing tag just means "up to the end"
+    response_text = response_text.partition(ASSESSMENT_END_TAG)[0]
+    
+    parsed = True
+    try:
+        review = _extract_json(response_text)
+    except json.JSONDecodeError:
+        parsed = False
+        # Fallback if parsing fails
+        review = {
+            "adequacy_assessment": {
+                "adequately_addressed": False,
+                "missing_aspects": ["Unable to parse assessment"],
+                "suggestions": ["Error processing assessment"],
+            },
+            "format_assessment": {
+                "formatting_issues": ["Unable to parse assessment"],
+                "improvements_made": ["Error processing formatting"],
+            },
+        }
+    
+    # Map onto the same fields the LangGraph pipeline produces
+    return {
+        "user_query": user_query,
+        "proposed_answer": proposed_answer,
+        "grammar_fixed_answer": review.get("grammar_fixed") or proposed_answer,
+        "adequacy_assessment": review.get("adequacy_assessment"),
+        "format_assessment": review.get("format_assessment"),
+        "final_answer": final_answer.strip() or proposed_answer,
+    }, parsed
+
+def parse_fused_message(user_query: str, proposed_answer: str, message) -> Tuple[Dict, bool]:
+    # Returns the review and whether it is safe to cache: parsed, and not cut off at max_tokens
+    result, parsed = parse_fused_response(user_query, proposed_answer, message.content[0].text)
+    return result, parsed and message.stop_reason != "max_tokens"
+
+def process_answer_fused(user_query: str, proposed_answer: str, formatting_examples: FormattingExamples, client=None) -> Dict:
+    return _process_answer_fused(user_query, proposed_answer, formatting_examples, client)[0]
+
+def _process_answer_fused(user_query: str, proposed_answer: str, formatting_examples: FormattingExamples, client=None) -> Tuple[Dict, bool]:
+    if not client:
+        client = get_shared_claude_client()
+    
+    message = client.messages.create(**build_fused_request(user_query, proposed_answer, formatting_examples))
+    return parse_fused_message(user_query, proposed_answer, message)
+
+class FusedAnswerStream:
+    # Iterating yields the final answer text as it streams in (e.g. into st.write_stream);
+    # the parsed review dict is available as .result once iteration has finished
+    def __init__(self, user_query: str, proposed_answer: str, formatting_examples: Optional[FormattingExamples] = None, client=None):
+        self.user_query = user_query
+        self.proposed_answer = proposed_answer
+        self.formatting_examples = formatting_examples
+        self.client = client
+        self.result: Optional[Dict] = None
+    
+    def __iter__(self):
+        formatting_examples = self.formatting_examples or load_formatting_examples_from_csv()
+        cache = get_response_cache()
+        cache_namespace = fused_cache_namespace(formatting_examples.prompt)
+        cached = cache.get(self.user_query, self.proposed_answer, cache_namespace)
+        if cached is not None:
+            self.result = cached
+            yield cached["final_answer"]
+            return
+        
+        client = self.client or get_shared_claude_client()
+        
+        pending = ""
+        answer_done = False
+        with client.messages.stream(**build_fused_request(self.user_query, self.proposed_answer, formatting_examples)) as stream:
+            for event in stream:
+                if answer_done or event.type != "content_block_delta" or event.delta.type != "text_delta":
+                    continue
+                pending += event.delta.text
+                if ASSESSMENT_TAG in pending:
+                    answer_done = True
+                    yield pending.split(ASSESSMENT_TAG)[0]
+                    continue
+                # Hold back anything that could be the start of a split ASSESSMENT_TAG
+                safe = len(pending) - len(ASSESSMENT_TAG) + 1
+                if safe > 0:
+                    yield pending[:safe]
+                    pending = pending[safe:]
+            message = stream.get_final_message()
+        if not answer_done and pending:
+            yield pending
+        
+        self.result, cacheable = parse_fused_message(self.user_query, self.proposed_answer, message)
+        if cacheable:
+            cache.set(self.user_query, self.proposed_answer, cache_namespace, self.result)
+
+# Message Batches API limits are 100,000 requests and 256 MB per batch; stay under the size cap with headroom
+BATCH_MAX_REQUESTS = 100_000
+BATCH_MAX_BYTES = 200 * 1024 * 1024
+
+def _split_batch_requests(requests: List[Dict]) -> List[List[Dict]]:
+    chunks = []
+    chunk, chunk_bytes = [], 0
+    for request in requests:
+        request_bytes = len(json.dumps(request).encode("utf-8"))
+        if chunk and (len(chunk) >= BATCH_MAX_REQUESTS or chunk_bytes + request_bytes > BATCH_MAX_BYTES):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(request)
+        chunk_bytes += request_bytes
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+# Offline path: submit many (user_query, proposed_answer) pairs as one Message Batch at the batch discount
+def process_answers_batch(pairs: List[Tuple[str, str]], formatting_examples: Optional[FormattingExamples] = None, client=None, poll_interval: float = 5.0, max_poll_interval: float = 60.0) -> List[Dict]:
+    if not client:
+        client = get_shared_claude_client()
+    if formatting_examples is None:
+        formatting_examples = load_formatting_examples_from_csv()
+    
+    cache = get_response_cache()
+    cache_namespace = fused_cache_namespace(formatting_examples.prompt)
+    results = [cache.get(user_query, proposed_answer, cache_namespace) for user_query, proposed_answer in pairs]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+    
+    requests = [
+        {"custom_id": f"pair-{i}", "params": build_fused_request(*pairs[i], formatting_examples)}
+        for i in pending
+    ]
+    # Every request repeats the ~40 KB fused system prompt, so large runs are split across several batches
+    batches = [client.messages.batches.create(requests=chunk) for chunk in _split_batch_requests(requests)]
+    
+    messages = {}
+    for batch in batches:
+        # Batches can take minutes to process, so back off exponentially while polling
+        delay = poll_interval
+        while batch.processing_status != "ended":
+            time.sleep(delay)
+            delay = min(delay * 2, max_poll_interval)
+            batch = client.messages.batches.retrieve(batch.id)
+        
+        for entry in client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                messages[entry.custom_id] = entry.result.message
+    
+    for i in pending:
+        user_query, proposed_answer = pairs[i]
+        message = messages.get(f"pair-{i}")
+        if message is None:
+            # Errored, canceled or expired requests keep the original answer with the parse-failure assessment
+            results[i] = parse_fused_response(user_query, proposed_answer, "")[0]
+            continue
+        results[i], cacheable = parse_fused_message(user_query, proposed_answer, message)
+        if cacheable:
+            cache.set(user_query, proposed_answer, cache_namespace, results[i])
+    return results
+
+async def process_answer_graph(graph, user_query: str, proposed_answer: str) -> Dict:
     # Initialize the state
     initial_state = AgentState(
         user_query=user_query,
         proposed_answer=proposed_answer
     )
     
-    # Build and run the graph
-    graph = build_answer_quality_graph(formatting_examples)
-    result = graph.invoke(initial_state)
+    async with get_async_claude_client() as client:
+        return await graph.ainvoke(initial_state, config={"configurable": {"client": client}})
+
+# Main function to process an answer
+def process_answer(user_query: str, proposed_answer: str, use_graph: bool = False, graph=None) -> Dict:
+    if use_graph or graph is not None:
+        # Step-by-step LangGraph pipeline, kept for debugging individual stages, so it bypasses the cache.
+        # Callers that run it repeatedly should pass a graph compiled once (see Home.get_graph)
+        if graph is None:
+            graph = build_answer_quality_graph(load_formatting_examples_from_csv())
+        result = asyncio.run(process_answer_graph(graph, user_query, proposed_answer))
+    else:
+        # Agents often resubmit the same answer, so check the response cache before calling Claude
+        formatting_examples = load_formatting_examples_from_csv()
+        cache = get_response_cache()
+        cache_namespace = fused_cache_namespace(formatting_examples.prompt)
+        result = cache.get(user_query, proposed_answer, cache_namespace)
+        if result is not None:
+            return {
+                "original_answer": proposed_answer,
+                "final_answer": result
+            }
+        result, cacheable = _process_answer_fused(user_query, proposed_answer, formatting_examples)
+        if cacheable:
+            cache.set(user_query, proposed_answer, cache_namespace, result)
     print(result)
     return {
         "original_answer": proposed_answer,
         "final_answer": result
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,245 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import faff_qa
+from faff_cache import SemanticCache
+
+REVIEW = {
+    "grammar_fixed": "Fixed answer.",
+    "adequacy_assessment": {"adequately_addressed": True, "missing_aspects": [], "suggestions": []},
+    "format_assessment": {"formatting_issues": [], "improvements_made": []},
+}
+
+
+class FakeStream:
+    def __init__(self, chunks, stop_reason="end_turn"):
+        self.chunks = chunks
+        self.stop_reason = stop_reason
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=chunk))
+
+    def get_final_message(self):
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text="".join(self.chunks))], stop_reason=self.stop_reason)
+
+
+class FakeStreamClient:
+    def __init__(self, chunks, stop_reason="end_turn"):
+        self.messages = SimpleNamespace(stream=lambda **kwargs: FakeStream(chunks, stop_reason))
+
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    cache = SemanticCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(faff_qa, "get_response_cache", lambda: cache)
+    return cache
+
+
+@pytest.mark.parametrize("closing_tag", ["", "\n</assessment>", "\n</assessment>\n"])
+def test_parse_fused_response_with_and_without_closing_tag(closing_tag):
+    response_text = "Final text\n<assessment>\n" + json.dumps(REVIEW) + closing_tag
+    result, parsed = faff_qa.parse_fused_response("query", "answer", response_text)
+    assert parsed
+    assert result["final_answer"] == "Final text"
+    assert result["grammar_fixed_answer"] == "Fixed answer."
+    assert result["adequacy_assessment"] == REVIEW["adequacy_assessment"]
+    assert result["format_assessment"] == REVIEW["format_assessment"]
+
+
+@pytest.mark.parametrize("assessment", [
+    "```json\n" + json.dumps(REVIEW) + "\n```",
+    json.dumps(dict(REVIEW, grammar_fixed="Run this:\n```\npip install faff\n```")),
+])
+def test_parse_fused_response_with_code_fences(assessment):
+    result, parsed = faff_qa.parse_fused_response("query", "answer", "Final text\n<assessment>\n" + assessment + "\n</assessment>")
+    assert parsed
+    assert result["adequacy_assessment"] == REVIEW["adequacy_assessment"]
+    assert result["grammar_fixed_answer"].startswith(("Fixed answer.", "Run this:\n```"))
+
+
+def test_fused_stream_holds_back_tag_split_across_chunks(response_cache):
+    response_text = "Hello there\n<assessment>\n" + json.dumps(REVIEW) + "\n</assessment>"
+    rest = response_text[len("Hello there\n<ass"):]
+    chunks = ["Hello ", "there\n<ass", rest[:4], rest[4:]]
+    assert "".join(chunks) == response_text
+
+    stream = faff_qa.FusedAnswerStream("query", "answer", faff_qa.load_formatting_examples_from_csv(), FakeStreamClient(chunks))
+    streamed = "".join(stream)
+    assert streamed == "Hello there\n"
+    assert "<" not in streamed
+    assert stream.result["final_answer"] == "Hello there"
+    assert stream.result["format_assessment"] == REVIEW["format_assessment"]
+
+
+@pytest.mark.parametrize("response_text, stop_reason, cached", [
+    ("Final text\n<assessment>\n" + json.dumps(REVIEW) + "\n</assessment>", "end_turn", True),
+    ("Final text\n<assessment>\nnot json", "end_turn", False),
+    ("Final text\n<assessment>\n" + json.dumps(REVIEW), "max_tokens", False),
+])
+def test_fused_stream_only_caches_complete_reviews(response_cache, response_text, stop_reason, cached):
+    stream = faff_qa.FusedAnswerStream("query", "answer", faff_qa.load_formatting_examples_from_csv(), FakeStreamClient([response_text], stop_reason))
+    list(stream)
+    namespace = faff_qa.fused_cache_namespace(faff_qa.load_formatting_examples_from_csv().prompt)
+    assert (response_cache.get("query", "answer", namespace) is not None) == cached
+
+
+def test_fused_cache_namespace_changes_with_examples():
+    examples_text = faff_qa.load_formatting_examples_from_csv().prompt
+    namespace = faff_qa.fused_cache_namespace(examples_text)
+    assert namespace.startswith("fused:" + faff_qa.CLAUDE_MODEL)
+    assert faff_qa.fused_cache_namespace(examples_text + "\nExample 20:\n") != namespace
+
+
+def test_graph_path_bypasses_response_cache(response_cache, monkeypatch):
+    response_cache.set("query", "answer", faff_qa.fused_cache_namespace(faff_qa.load_formatting_examples_from_csv().prompt), {"final_answer": "cached"})
+
+    async def run_graph(graph, user_query, proposed_answer):
+        return {"final_answer": "from graph"}
+    monkeypatch.setattr(faff_qa, "process_answer_graph", run_graph)
+
+    result = faff_qa.process_answer("query", "answer", graph=object())
+    assert result["final_answer"]["final_answer"] == "from graph"
+
+
+@pytest.mark.parametrize("stop_reason, expected", [("end_turn", "Fixed."), ("max_tokens", "नमस्ते, आपका ऑर्डर")])
+def test_fix_grammar_discards_truncated_reply(stop_reason, expected):
+    async def create(**kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text="Fixed.")], stop_reason=stop_reason)
+    client = SimpleNamespace(messages=SimpleNamespace(create=create))
+    state = faff_qa.AgentState(user_query="query", proposed_answer="नमस्ते, आपका ऑर्डर")
+
+    result = asyncio.run(faff_qa.fix_grammar(state, client))
+    assert result["grammar_fixed_answer"] == expected
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("Hi, your order is confirmed and will arrive by Friday.", False),
+    ("The total is Rs. 2800. Let us know if that works.", False),
+    ("Steps: • open app • tap Orders", True),
+    ("To cancel: 1. open the app 2. tap Orders 3. choose Cancel", True),
+    ("- open the app and tap Orders", True),
+    ("Book here: https://example.com", True),
+    ("Line one\nLine two", True),
+])
+def test_formatting_likely_bad(answer, expected):
+    assert faff_qa._formatting_likely_bad(answer) == expected
+
+
+def test_formatting_examples_are_never_skipped():
+    for example in faff_qa.load_formatting_examples_from_csv().examples:
+        assert faff_qa._formatting_likely_bad(example["bad_format"])
+
+
+def graph_client(adequately_addressed, adequacy_answer):
+    calls = []
+
+    async def create(**kwargs):
+        if not kwargs.get("tools"):
+            return SimpleNamespace(content=[SimpleNamespace(type="text", text="Fixed answer.\nSecond line")], stop_reason="end_turn")
+        if kwargs["tool_choice"]["name"] == "return_adequacy":
+            review = {"adequately_addressed": adequately_addressed, "missing_aspects": [], "suggestions": [], "improved_answer": adequacy_answer}
+            return SimpleNamespace(content=[SimpleNamespace(type="tool_use", input=review)])
+        answer = kwargs["messages"][0]["content"].split("Current Answer:\n", 1)[1]
+        calls.append(answer)
+        review = {"formatting_issues": [f"issue in {answer}"], "improvements_made": [], "improved_answer": f"formatted {answer}"}
+        return SimpleNamespace(content=[SimpleNamespace(type="tool_use", input=review)])
+
+    return SimpleNamespace(messages=SimpleNamespace(create=create)), calls
+
+
+@pytest.mark.parametrize("adequately_addressed, adequacy_answer, final_answer, formatted", [
+    (True, "Fixed answer.\nSecond line", "formatted Fixed answer.\nSecond line", ["Fixed answer.\nSecond line"]),
+    (False, "Rewrite.\n1. step", "formatted Rewrite.\n1. step", ["Fixed answer.\nSecond line", "Rewrite.\n1. step"]),
+    (False, "Short plain rewrite.", "Short plain rewrite.", ["Fixed answer.\nSecond line"]),
+])
+def test_graph_formats_the_answer_it_returns(adequately_addressed, adequacy_answer, final_answer, formatted, monkeypatch):
+    # Only the injected client should be used; no node may fall back to building one from the environment
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    client, calls = graph_client(adequately_addressed, adequacy_answer)
+    graph = faff_qa.build_answer_quality_graph(faff_qa.load_formatting_examples_from_csv())
+    state = faff_qa.AgentState(user_query="query", proposed_answer="answer")
+
+    result = asyncio.run(graph.ainvoke(state, config={"configurable": {"client": client}}))
+    assert result["final_answer"] == final_answer
+    assert sorted(calls) == sorted(formatted)
+    if final_answer.startswith("formatted "):
+        assert result["format_assessment"]["formatting_issues"] == [f"issue in {final_answer[len('formatted '):]}"]
+    else:
+        assert result["format_assessment"] is None
+
+
+class FakeBatches:
+    # Entries whose proposed answer contains "errored" fail, "bad json" doesn't parse, "truncated" hits max_tokens
+    def __init__(self):
+        self.submitted = {}
+        self.polls = 0
+
+    def create(self, requests):
+        batch_id = f"batch-{len(self.submitted)}"
+        self.submitted[batch_id] = requests
+        return SimpleNamespace(id=batch_id, processing_status="in_progress")
+
+    def retrieve(self, batch_id):
+        self.polls += 1
+        return SimpleNamespace(id=batch_id, processing_status="ended")
+
+    def results(self, batch_id):
+        # Results come back in arbitrary order, so map them by custom_id rather than position
+        for request in reversed(self.submitted[batch_id]):
+            content = request["params"]["messages"][0]["content"]
+            if "errored" in content:
+                yield SimpleNamespace(custom_id=request["custom_id"], result=SimpleNamespace(type="errored"))
+                continue
+            assessment = "not json" if "bad json" in content else json.dumps(REVIEW)
+            text = f"Final for {content.splitlines()[0]}\n<assessment>\n{assessment}\n</assessment>"
+            stop_reason = "max_tokens" if "truncated" in content else "end_turn"
+            message = SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], stop_reason=stop_reason)
+            yield SimpleNamespace(custom_id=request["custom_id"], result=SimpleNamespace(type="succeeded", message=message))
+
+
+def test_process_answers_batch(response_cache, monkeypatch):
+    monkeypatch.setattr(faff_qa, "BATCH_MAX_REQUESTS", 2)
+    formatting_examples = faff_qa.load_formatting_examples_from_csv()
+    namespace = faff_qa.fused_cache_namespace(formatting_examples.prompt)
+    response_cache.set("cached query", "answer", namespace, {"final_answer": "from cache"})
+    pairs = [
+        ("cached query", "answer"),
+        ("q1", "fine"),
+        ("q2", "errored"),
+        ("q3", "bad json"),
+        ("q4", "truncated"),
+        ("q5", "fine"),
+    ]
+    batches = FakeBatches()
+    client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+
+    results = faff_qa.process_answers_batch(pairs, formatting_examples, client, poll_interval=0)
+
+    # The cached pair is not resubmitted and the rest are split into batches of at most two
+    assert [len(requests) for requests in batches.submitted.values()] == [2, 2, 1]
+    assert [result["final_answer"] for result in results] == [
+        "from cache", "Final for User Query: q1", "errored", "Final for User Query: q3", "Final for User Query: q4", "Final for User Query: q5",
+    ]
+    assert results[2]["adequacy_assessment"]["missing_aspects"] == ["Unable to parse assessment"]
+    assert results[3]["adequacy_assessment"]["missing_aspects"] == ["Unable to parse assessment"]
+    cached = [query for query, answer in pairs if response_cache.get(query, answer, namespace) is not None]
+    assert cached == ["cached query", "q1", "q5"]
+
+
+def test_split_batch_requests_respects_size_cap(monkeypatch):
+    monkeypatch.setattr(faff_qa, "BATCH_MAX_BYTES", 100)
+    requests = [{"custom_id": f"pair-{i}", "params": {"text": "x" * 30}} for i in range(5)]
+    chunks = faff_qa._split_batch_requests(requests)
+    assert [request for chunk in chunks for request in chunk] == requests
+    assert all(sum(len(json.dumps(request)) for request in chunk) <= 100 for chunk in chunks)
+    assert len(chunks) > 1